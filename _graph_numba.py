@@ -0,0 +1,211 @@
+"""Numba compiled versions of the graph algorithms of vrog.
+
+The graphs are in compressed sparse row form, as built by BuildSystem._compile_graph:
+the edges of node are indices[indptr[node]:indptr[node + 1]].
+"""
+import array
+
+import numba
+import numpy as np
+
+
+def csr(indptr: array.array, indices: array.array) -> tuple[np.ndarray, np.ndarray]:
+    """Returns numpy views of the array("i") pair of a graph, without copying."""
+    return np.frombuffer(indptr, dtype=np.intc), np.frombuffer(indices, dtype=np.intc)
+
+
+@numba.njit(cache=True)
+def tarjan_scc(indptr: np.ndarray, indices: np.ndarray) -> np.ndarray:
+    """Finds the strongly connected components of a graph with Tarjan's algorithm.
+
+    Returns the component of each node. Components are numbered in the order they
+    are completed, so edges only lead to the same or lower numbered components.
+    """
+    count = indptr.shape[0] - 1
+    index = np.full(count, -1, np.int32)
+    lowlink = np.zeros(count, np.int32)
+    on_stack = np.zeros(count, np.bool_)
+    component = np.full(count, -1, np.int32)
+    component_stack = np.empty(count, np.int32)
+    component_top = 0
+    # Explicit stack of (node, position of its next edge)
+    work_node = np.empty(count, np.int32)
+    work_position = np.empty(count, np.int32)
+    work_top = 0
+    visited = 0
+    components = 0
+
+    for root in range(count):
+        if index[root] != -1:
+            continue
+        index[root] = visited
+        lowlink[root] = visited
+        visited += 1
+        component_stack[component_top] = root
+        component_top += 1
+        on_stack[root] = True
+        work_node[0] = root
+        work_position[0] = indptr[root]
+        work_top = 1
+        while work_top > 0:
+            node = work_node[work_top - 1]
+            position = work_position[work_top - 1]
+            end = indptr[node + 1]
+            dep = -1
+            while position < end:
+                candidate = indices[position]
+                position += 1
+                if index[candidate] == -1:
+                    dep = candidate
+                    break
+                if on_stack[candidate] and index[candidate] < lowlink[node]:
+                    lowlink[node] = index[candidate]
+
+            if dep == -1:
+                work_top -= 1
+                if work_top > 0:
+                    parent = work_node[work_top - 1]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+                if lowlink[node] == index[node]:
+                    while True:
+                        component_top -= 1
+                        member = component_stack[component_top]
+                        on_stack[member] = False
+                        component[member] = components
+                        if member == node:
+                            break
+                    components += 1
+                continue
+
+            work_position[work_top - 1] = position
+            index[dep] = visited
+            lowlink[dep] = visited
+            visited += 1
+            component_stack[component_top] = dep
+            component_top += 1
+            on_stack[dep] = True
+            work_node[work_top] = dep
+            work_position[work_top] = indptr[dep]
+            work_top += 1
+
+    return component
+
+
+@numba.njit(cache=True)
+def circular_nodes(indptr: np.ndarray, indices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Finds the nodes of a graph which are on or lead to a cycle.
+
+    Returns whether each node is circular, and the nodes of the lowest numbered
+    strongly connected component which is a cycle, or no nodes if there is none.
+    """
+    component = tarjan_scc(indptr, indices)
+    count = component.shape[0]
+    components = component.max() + 1 if count else 0
+
+    # The nodes of each component, in the same form as the graph
+    members_indptr = np.zeros(components + 1, np.int32)
+    for node in range(count):
+        members_indptr[component[node] + 1] += 1
+    members_indptr = np.cumsum(members_indptr)
+    fill = members_indptr[:-1].copy()
+    members = np.empty(count, np.int32)
+    for node in range(count):
+        members[fill[component[node]]] = node
+        fill[component[node]] += 1
+
+    # Whether each component is or leads to a cycle. Dependencies are in lower
+    # numbered components, so visit components in order.
+    circular = np.zeros(components, np.uint8)
+    cycle = -1
+    for current in range(components):
+        is_cycle = members_indptr[current + 1] - members_indptr[current] > 1
+        leads_to_cycle = False
+        for i in range(members_indptr[current], members_indptr[current + 1]):
+            node = members[i]
+            for position in range(indptr[node], indptr[node + 1]):
+                dep = indices[position]
+                if dep == node:
+                    is_cycle = True
+                elif circular[component[dep]]:
+                    leads_to_cycle = True
+        if is_cycle or leads_to_cycle:
+            circular[current] = 1
+        if is_cycle and cycle == -1:
+            cycle = current
+
+    if cycle == -1:
+        return circular[component], members[:0]
+    return circular[component], members[members_indptr[cycle]:members_indptr[cycle + 1]]
+
+
+@numba.njit(cache=True)
+def kahn_waves(
+    indptr: np.ndarray,
+    indices: np.ndarray,
+    root: int,
+    rule_count: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """Schedules the nodes reachable from root in waves with Kahn's algorithm.
+
+    The graph must be free of cycles. Nodes from rule_count on are left out.
+    Returns the nodes ordered by wave, and the end of each wave in that order.
+    """
+    pending = np.full(rule_count, -1, np.int32)
+    dependent_counts = np.zeros(rule_count + 1, np.int32)
+    # Every node is expanded once, so there is at most one push per edge
+    stack = np.empty(indices.shape[0] + 1, np.int32)
+    stack[0] = root
+    top = 1
+    while top > 0:
+        top -= 1
+        node = stack[top]
+        if pending[node] != -1:
+            continue
+        pending[node] = 0
+        for position in range(indptr[node], indptr[node + 1]):
+            dep = indices[position]
+            if dep < rule_count:
+                pending[node] += 1
+                dependent_counts[dep + 1] += 1
+                stack[top] = dep
+                top += 1
+
+    # The reverse edges of the reachable nodes, in the same form
+    dependents_indptr = np.cumsum(dependent_counts)
+    fill = dependents_indptr[:-1].copy()
+    dependents = np.empty(dependents_indptr[-1], np.int32)
+    for node in range(rule_count):
+        if pending[node] == -1:
+            continue
+        for position in range(indptr[node], indptr[node + 1]):
+            dep = indices[position]
+            if dep < rule_count:
+                dependents[fill[dep]] = node
+                fill[dep] += 1
+
+    order = np.empty(rule_count, np.int32)
+    length = 0
+    for node in range(rule_count):
+        if pending[node] == 0:
+            order[length] = node
+            length += 1
+
+    ends = np.empty(rule_count, np.int32)
+    waves = 0
+    start = 0
+    while start < length:
+        end = length
+        for i in range(start, end):
+            node = order[i]
+            for j in range(dependents_indptr[node], dependents_indptr[node + 1]):
+                dependent = dependents[j]
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    order[length] = dependent
+                    length += 1
+        ends[waves] = end
+        waves += 1
+        start = end
+
+    return order[:length], ends[:waves]
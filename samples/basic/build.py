@@ -10,15 +10,13 @@ def main():
     bs = vrog.BuildSystem()
 
     def link(rule, target):
-        cmd = f"cc -o {target} {' '.join(rule.deps)}"
-        vrog.run_cmd(cmd)
+        vrog.run_cmd(["cc", "-o", target, *rule.deps])
 
     bs.add_rule("example.out", vrog.BuildRule(["a.o", "b.o", "c.o", "main.o"], link))
 
 
     def compile(rule, target):
-        cmd = f"cc -c -o {target} {rule.deps[0]}"
-        vrog.run_cmd(cmd)
+        vrog.run_cmd(["cc", "-c", "-o", target, rule.deps[0]])
 
     for trans_unit in ["a", "b", "c", "main"]:
         bs.add_rule(f"{trans_unit}.o", vrog.BuildRule([f"{trans_unit}.c", f"{trans_unit}.h"], compile))
@@ -0,0 +1,102 @@
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import vrog
+
+
+def copy(rule: vrog.BuildRule, target: str) -> None:
+    """Copies the first dependency of rule to target."""
+    shutil.copyfile(rule.deps[0], target)
+
+
+class CacheTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(directory)
+        with open("in.txt", "w") as file:
+            file.write("contents\n")
+
+
+    def build(
+        self,
+        rules: dict[str, vrog.BuildRule],
+        target: str,
+        cache: str=".vrog-cache"
+    ) -> list[str]:
+        """Builds target with a new BuildSystem of rules and returns the targets it ran."""
+        bs = vrog.BuildSystem(cache=cache)
+        if bs._cache is not None:
+            self.addCleanup(bs._cache.close)
+        for name, rule in rules.items():
+            bs.add_rule(name, rule)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            bs.build(target)
+        return output.getvalue().split()
+
+
+    def set_mtime(self, path: str, offset: float) -> None:
+        """Moves the modification time of path by offset seconds."""
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + offset))
+
+
+    def test_touch(self):
+        rules = {"out.txt": vrog.BuildRule(["in.txt"], copy)}
+        self.assertEqual(self.build(rules, "out.txt"), ["out.txt"])
+        self.set_mtime("in.txt", 10)
+        self.assertEqual(self.build(rules, "out.txt"), [])
+
+
+    def test_content_change(self):
+        rules = {"out.txt": vrog.BuildRule(["in.txt"], copy)}
+        self.assertEqual(self.build(rules, "out.txt"), ["out.txt"])
+        with open("in.txt", "w") as file:
+            file.write("other contents\n")
+        self.assertEqual(self.build(rules, "out.txt"), ["out.txt"])
+        with open("out.txt") as file:
+            self.assertEqual(file.read(), "other contents\n")
+        self.assertEqual(self.build(rules, "out.txt"), [])
+
+
+    def test_output_change(self):
+        rules = {"out.txt": vrog.BuildRule(["in.txt"], copy)}
+        self.assertEqual(self.build(rules, "out.txt"), ["out.txt"])
+        with open("out.txt", "w") as file:
+            file.write("edited\n")
+        self.assertEqual(self.build(rules, "out.txt"), ["out.txt"])
+
+
+    @unittest.skipUnless(shutil.which("cc"), "cc is not installed")
+    def test_compiler_flags(self):
+        with open("main.c", "w") as file:
+            file.write("int main(void) { return VALUE; }\n")
+        for value, runs in (("0", ["main.o"]), ("0", []), ("1", ["main.o"])):
+            compiler = vrog.Compiler(definitions=[f"VALUE={value}"])
+            rules = {"main.o": vrog.CompilerRule("main.c", compiler)}
+            self.assertEqual(self.build(rules, "main.o"), runs)
+
+
+    def test_no_cache(self):
+        rules = {"out.txt": vrog.BuildRule(["in.txt"], copy)}
+        self.assertEqual(self.build(rules, "out.txt", cache=None), ["out.txt"])
+        self.assertFalse(os.path.exists(".vrog-cache"))
+        self.set_mtime("out.txt", 10)
+        self.assertEqual(self.build(rules, "out.txt", cache=None), [])
+        # Only modification times count, not contents
+        self.set_mtime("in.txt", 20)
+        self.assertEqual(self.build(rules, "out.txt", cache=None), ["out.txt"])
+
+
+if __name__ == "__main__":
+    unittest.main()
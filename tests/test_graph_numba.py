@@ -0,0 +1,93 @@
+import os
+import sys
+import array
+import random
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import vrog
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+
+def random_graph(count: int, edges: int, acyclic: bool) -> tuple[array.array, array.array]:
+    """Returns a random graph of count nodes in the form of BuildSystem._compile_graph.
+
+    If acyclic, edges only lead to higher numbered nodes.
+    """
+    deps = [[] for _ in range(count)]
+    for _ in range(edges):
+        node = random.randrange(count - 1 if acyclic else count)
+        deps[node].append(random.randrange(node + 1, count) if acyclic else random.randrange(count))
+    indptr = array.array("i", [0])
+    indices = array.array("i")
+    for node_deps in deps:
+        indices.extend(node_deps)
+        indptr.append(len(indices))
+    return indptr, indices
+
+
+def partition(component: list[int]) -> set[frozenset[int]]:
+    """Returns the nodes of each component."""
+    members = {}
+    for node, number in enumerate(component):
+        members.setdefault(number, set()).add(node)
+    return {frozenset(nodes) for nodes in members.values()}
+
+
+@unittest.skipIf(numba is None, "numba is not installed")
+class GraphNumbaTest(unittest.TestCase):
+    def setUp(self):
+        random.seed(0)
+        self.graph_numba = vrog._load_graph_numba()
+
+
+    def test_loaded(self):
+        self.assertIsNotNone(self.graph_numba)
+
+
+    def test_tarjan_scc(self):
+        for count, edges in ((1, 0), (1, 1), (10, 15), (200, 250), (200, 600)):
+            indptr, indices = random_graph(count, edges, acyclic=False)
+            expected = vrog._tarjan_scc(indptr, indices)
+            component = self.graph_numba.tarjan_scc(*self.graph_numba.csr(indptr, indices))
+            self.assertEqual(partition(component.tolist()), partition(expected))
+            # Edges only lead to the same or lower numbered components
+            for node in range(count):
+                for dep in indices[indptr[node]:indptr[node + 1]]:
+                    self.assertLessEqual(component[dep], component[node])
+
+
+    def test_circular_nodes(self):
+        for count, edges, acyclic in ((1, 1, False), (10, 15, False), (200, 250, False),
+                                      (200, 600, False), (200, 600, True)):
+            indptr, indices = random_graph(count, edges, acyclic)
+            circular, cycle = self.graph_numba.circular_nodes(
+                *self.graph_numba.csr(indptr, indices))
+            expected_circular, expected_cycle = vrog._circular_nodes(indptr, indices)
+            self.assertEqual(bytearray(circular), expected_circular)
+            self.assertEqual(sorted(cycle.tolist()), sorted(expected_cycle))
+
+
+    def test_kahn_waves(self):
+        for count, edges, rule_count in ((1, 0, 1), (10, 15, 10), (200, 600, 200), (200, 600, 150)):
+            indptr, indices = random_graph(count, edges, acyclic=True)
+            expected_order, expected_ends = vrog._kahn_waves(indptr, indices, 0, rule_count)
+            order, ends = self.graph_numba.kahn_waves(
+                *self.graph_numba.csr(indptr, indices), 0, rule_count)
+            self.assertEqual(ends.tolist(), expected_ends)
+            # The order within a wave does not matter
+            start = 0
+            for end in expected_ends:
+                self.assertEqual(
+                    sorted(order[start:end].tolist()), sorted(expected_order[start:end]))
+                start = end
+
+
+if __name__ == "__main__":
+    unittest.main()
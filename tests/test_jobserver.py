@@ -0,0 +1,101 @@
+import os
+import sys
+import shutil
+import tempfile
+import textwrap
+import unittest
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import vrog
+
+# Logs its start to the file argv[1], waits until argv[2] tasks have started, so
+# that they overlap however loaded the machine is, then logs its end
+TASK = textwrap.dedent("""\
+    import sys
+    import time
+
+    log, wait_for = sys.argv[1], int(sys.argv[2])
+    with open(log, "a") as file:
+        file.write("+\\n")
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        with open(log) as file:
+            if file.read().count("+") >= wait_for:
+                break
+        time.sleep(0.01)
+    # Leaves time for a task which should not run yet to start
+    time.sleep(0.1)
+    with open(log, "a") as file:
+        file.write("-\\n")
+""")
+
+# Builds six rules which each run TASK with argv[1] as its wait_for
+INNER = textwrap.dedent("""\
+    import sys
+    import vrog
+
+    cmd = [sys.executable, "task.py", "log", sys.argv[1]]
+    bs = vrog.BuildSystem(cache=None)
+    for i in range(6):
+        bs.add_rule(f"t{i}", vrog.BuildRule([], lambda rule, target: vrog.run_cmd(cmd)))
+    bs.add_rule("all", vrog.BuildRule([f"t{i}" for i in range(6)], lambda rule, target: None))
+    bs.build_parallel("all", jobs=6)
+""")
+
+
+@unittest.skipUnless(os.name == "posix", "the jobserver pipe requires POSIX")
+class JobserverTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        for name, contents in (("task.py", TASK), ("inner.py", INNER)):
+            with open(os.path.join(self.directory, name), "w") as file:
+                file.write(contents)
+        self.env = os.environ.copy()
+        self.env.pop("MAKEFLAGS", None)
+        self.env["PYTHONPATH"] = ROOT
+
+
+    def run_inner(self, cmd: list[str], **kwargs) -> int:
+        """Runs cmd in the test directory and returns the most tasks which ran at once."""
+        completed = subprocess.run(
+            cmd, cwd=self.directory, stdout=subprocess.PIPE, text=True, timeout=60, **kwargs)
+        self.assertEqual(completed.returncode, 0, completed.stdout)
+        running = most = 0
+        with open(os.path.join(self.directory, "log")) as file:
+            for line in file:
+                running += 1 if line == "+\n" else -1
+                most = max(most, running)
+        return most
+
+
+    @unittest.skipUnless(shutil.which("make"), "make is not installed")
+    def test_make(self):
+        with open(os.path.join(self.directory, "Makefile"), "w") as file:
+            file.write(f"all:\n\t+{sys.executable} inner.py 2\n")
+        # make -j2 passes one token besides the implicit slot
+        self.assertEqual(self.run_inner(["make", "-s", "-j2"], env=self.env), 2)
+
+
+    def test_jobs_beyond_cpu_count(self):
+        self.assertEqual(self.run_inner([sys.executable, "inner.py", "6"], env=self.env), 6)
+
+
+    def test_nested(self):
+        # The outer build holds the only token for the inner build, as run_cmd would
+        jobserver = vrog.Jobserver(1)
+        token = jobserver.acquire()
+        try:
+            env = dict(jobserver.env, PYTHONPATH=ROOT)
+            most = self.run_inner(
+                [sys.executable, "inner.py", "1"], env=env, close_fds=False)
+        finally:
+            jobserver.release(token)
+        self.assertEqual(most, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,9 +1,43 @@
 import os
+import re
+import sys
+import json
+import mmap
+import queue
+import array
+import atexit
+import asyncio
+import shutil
+import select
+import hashlib
+import importlib
+import sqlite3
+import functools
 import subprocess
 import dataclasses
+import collections
+import concurrent.futures
+import threading
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+try:
+    import liburing
+except ImportError:
+    liburing = None
 
 class BuildRule:
     """A BuildRule builds a target from its dependencies."""
+    __slots__ = ("deps", "task_impl")
+
     def __init__(self, deps: list[str], task):
         """Initializes a BuildRule.
 
@@ -13,12 +47,12 @@ class BuildRule:
           The function which builds the target from the dependencies.
           This function should have arguments (self: BuildRule, target: str)
         """
-        if type(deps) is not list:
-            raise TypeError(f"deps {deps} should be a list")
+        if __debug__:
+            if not isinstance(deps, list):
+                raise TypeError(f"deps {deps} should be a list")
+            if not callable(task):
+                raise TypeError(f"task {task} should be callable")
         self.deps = deps
-
-        if not callable(task):
-            raise TypeError(f"task {task} should be callable")
         self.task_impl = task
 
 
@@ -27,7 +61,16 @@ class BuildRule:
         self.task_impl(self, target)
 
 
-@dataclasses.dataclass
+    def command(self, target: str) -> list[str]:
+        """Returns the command the task runs to build target, or None if it is unknown.
+
+        A change of the command invalidates target in the build cache.
+        BuildSystem.build_parallel runs the command in place of the task.
+        """
+        return None
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
 class Compiler():
     """Abstracts a compiler invocation.
 
@@ -49,15 +92,23 @@ class Compiler():
     standard_option: str="-std="
     optimization: str=None
     optimization_option: str="-O"
-    warnings: list[str]=dataclasses.field(default_factory=list)
+    warnings: tuple[str, ...]=()
     warning_option: str="-W"
-    definitions: list[str]=dataclasses.field(default_factory=list)
+    definitions: tuple[str, ...]=()
     definition_option: str="-D"
-    extra_args: list[str]=dataclasses.field(default_factory=list)
+    extra_args: tuple[str, ...]=()
+
+
+    def __post_init__(self):
+        """Stores the argument lists as tuples, so a Compiler is hashable."""
+        for field in ("warnings", "definitions", "extra_args"):
+            object.__setattr__(self, field, tuple(getattr(self, field)))
 
 
 class CompilerRule(BuildRule):
     """A rule which compiles an object file from a source file."""
+    __slots__ = ("source", "compiler", "_cmd_prefix")
+
     def __init__(
         self,
         source: str,
@@ -70,33 +121,40 @@ class CompilerRule(BuildRule):
         compiler
           The compiler to invoke.
         """
-        if type(source) is not str:
-            raise TypeError(f"source {source} should be a string")
-        if type(compiler) is not Compiler:
-            raise TypeError(f"compiler {compiler} should be a compiler")
+        if __debug__:
+            if type(source) is not str:
+                raise TypeError(f"source {source} should be a string")
+            if not isinstance(compiler, Compiler):
+                raise TypeError(f"compiler {compiler} should be a compiler")
         self.source = source
         self.deps = gen_deps(source, compiler)
         self.compiler = compiler
 
+        self._cmd_prefix = [compiler.compiler, "-c"]
+        if compiler.standard:
+            self._cmd_prefix.append(compiler.standard_option + compiler.standard)
+        if compiler.optimization:
+            self._cmd_prefix.append(compiler.optimization_option + compiler.optimization)
+        self._cmd_prefix += [compiler.warning_option + warning for warning in compiler.warnings]
+        self._cmd_prefix += [
+            compiler.definition_option + definition for definition in compiler.definitions]
+        self._cmd_prefix += compiler.extra_args
+
 
     def task(self, target: str) -> None:
         """Invokes the compiler to build target"""
-        if type(target) is not str:
-            raise TypeError(f"target {target} should be a string")
-        cmd = [self.compiler.compiler, "-c"]
-        if self.compiler.standard:
-            cmd.append(self.compiler.standard_option + self.compiler.standard)
-        if self.compiler.optimization:
-            cmd.append(self.optimization_option + self.compiler.optimization)
-        cmd += [warning_option + warning for warning in self.compiler.warnings]
-        cmd += [definition_option + definition for definition in self.compiler.definitions]
-        cmd += self.compiler.extra_args
-        cmd += ["-o", target]
-        cmd.append(self.source)
-        subprocess.run(cmd)
-
-
-@dataclasses.dataclass
+        _run(self.command(target), check=True, pooled=True)
+
+
+    def command(self, target: str) -> list[str]:
+        """Returns the compiler invocation which builds target."""
+        if __debug__:
+            if type(target) is not str:
+                raise TypeError(f"target {target} should be a string")
+        return self._cmd_prefix + ["-o", target, self.source]
+
+
+@dataclasses.dataclass(slots=True, frozen=True)
 class Linker():
     """Abstracts a linker invocation.
 
@@ -110,15 +168,23 @@ class Linker():
       Arguments passed as they are.
     """
     linker: str="cc"
-    libraries: list[str]=dataclasses.field(default_factory=list)
+    libraries: tuple[str, ...]=()
     library_option: str="-l"
-    linker_args: list[str]=dataclasses.field(default_factory=list)
+    linker_args: tuple[str, ...]=()
     linker_arg_option: str="-Wl,"
-    extra_args: list[str]=dataclasses.field(default_factory=list)
+    extra_args: tuple[str, ...]=()
+
+
+    def __post_init__(self):
+        """Stores the argument lists as tuples, so a Linker is hashable."""
+        for field in ("libraries", "linker_args", "extra_args"):
+            object.__setattr__(self, field, tuple(getattr(self, field)))
 
 
 class LinkerRule(BuildRule):
     """A rule which links a target from object files."""
+    __slots__ = ("linker", "_cmd_prefix")
+
     def __init__(
         self,
         objects: list[str],
@@ -131,29 +197,38 @@ class LinkerRule(BuildRule):
         linker
           The linker to invoke.
         """
-        if type(objects) is not list:
-            raise TypeError(f"objects {objects} should be a list")
-        if type(linker) is not Linker:
-            raise TypeError(f"linker {linker} should be a linker")
+        if __debug__:
+            if not isinstance(objects, list):
+                raise TypeError(f"objects {objects} should be a list")
+            if not isinstance(linker, Linker):
+                raise TypeError(f"linker {linker} should be a linker")
         self.deps = objects
         self.linker = linker
 
+        self._cmd_prefix = [linker.linker]
+        self._cmd_prefix += [linker.library_option + lib for lib in linker.libraries]
+        self._cmd_prefix += [linker.linker_arg_option + link for link in linker.linker_args]
+        self._cmd_prefix += linker.extra_args
+        self._cmd_prefix += objects
+
 
     def task(self, target: str) -> None:
         """Invokes the linker to build target."""
-        if type(target) is not str:
-            raise TypeError(f"target {target} should be a string")
-        cmd = [self.linker.linker]
-        cmd += [self.linker.library_option + lib for lib in self.linker.libraries]
-        cmd += [self.linker.linker_arg_option + link for link in self.linker.linker_args]
-        cmd += self.linker.extra_args
-        cmd += self.deps
-        cmd += ["-o", target]
-        subprocess.run(cmd)
+        _run(self.command(target), check=True, pooled=True)
+
+
+    def command(self, target: str) -> list[str]:
+        """Returns the linker invocation which builds target."""
+        if __debug__:
+            if type(target) is not str:
+                raise TypeError(f"target {target} should be a string")
+        return self._cmd_prefix + ["-o", target]
 
 
 class CleanRule(BuildRule):
     """A rule for cleaning targets."""
+    __slots__ = ("targets",)
+
     def __init__(self, targets: list[str]):
         """Initializes a CleanRule.
 
@@ -161,8 +236,9 @@ class CleanRule(BuildRule):
           Targets to remove on clean.
         """
         self.deps = []
-        if type(targets) is not list:
-            raise TypeError(f"targets {targets} should be a list")
+        if __debug__:
+            if not isinstance(targets, list):
+                raise TypeError(f"targets {targets} should be a list")
         self.targets = targets
 
 
@@ -186,18 +262,634 @@ def gen_deps(
       The compiler that generates the dependency list.
     """
     cmd = [compiler.compiler, "-MM", "-MP"]
-    cmd += [definition_option + definition for definition in compiler.definitions]
+    cmd += [compiler.definition_option + definition for definition in compiler.definitions]
     cmd += compiler.extra_args
     cmd.append(source)
-    make_rules = subprocess.run(cmd, capture_output=True, text=True).stdout
-    return make_rules.replace("\\\n", "").splitlines()[0].split()[1:]
+    return list(_gen_deps(tuple(cmd)))
+
+
+@functools.lru_cache(maxsize=None)
+def _gen_deps(cmd: tuple[str]) -> tuple[str]:
+    """Runs cmd and returns the dependencies of the first make rule it outputs.
+
+    The output is read until the end of the first rule. Results are cached for
+    the lifetime of the process.
+    """
+    rule = []
+    with subprocess.Popen(
+            _spawnable(list(cmd)), stdout=subprocess.PIPE, text=True, close_fds=False) as process:
+        for line in process.stdout:
+            if line.endswith("\\\n"):
+                rule.append(line[:-2])
+                continue
+            rule.append(line)
+            break
+        # The phony rules of -MP are not needed, the process may exit on SIGPIPE
+        process.stdout.close()
+    if not rule:
+        raise subprocess.CalledProcessError(process.returncode, cmd)
+    return tuple(" ".join(rule).split()[1:])
+
+
+class Jobserver:
+    """Limits the number of subprocesses running at once.
+
+    Joins the GNU make jobserver advertised in MAKEFLAGS, so that a build
+    invoked from make -jN or from another vrog build shares its job slots.
+    Otherwise, it serves job slots itself to the subprocesses it runs.
+    """
+    def __init__(self, jobs: int=None):
+        """Initializes a Jobserver.
+
+        jobs
+          The number of job slots when serving. Defaults to os.cpu_count().
+        """
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        if type(jobs) is not int or jobs < 1:
+            raise ValueError(f"jobs {jobs} should be a positive integer")
+
+        self.jobs = jobs
+        self._makeflags = None
+        self._read_fd = None
+        self._write_fd = None
+        self._semaphore = None
+        # Every job owns one implicit slot which is never written to the pipe.
+        # Releasing it writes to the wakeup pipe, so that waiters selecting on
+        # the jobserver pipe notice.
+        self._lock = threading.Lock()
+        self._implicit_free = False
+        self._wakeup_read = None
+        self._wakeup_write = None
+
+        auth = _jobserver_auth(os.environ.get("MAKEFLAGS", ""))
+        if auth is not None:
+            try:
+                if auth.startswith("fifo:"):
+                    path = auth[len("fifo:"):]
+                    self._read_fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+                    self._write_fd = os.open(path, os.O_WRONLY)
+                else:
+                    read_fd, self._write_fd = (int(fd) for fd in auth.split(","))
+                    os.fstat(self._write_fd)
+                    self._read_fd = _open_nonblocking(read_fd)
+            except (OSError, ValueError):
+                # make did not pass the jobserver to us, e.g. a rule without "+"
+                self._read_fd = self._write_fd = None
+                self._semaphore = threading.Semaphore(jobs)
+                return
+            self._implicit_free = True
+            self._wakeup_read, self._wakeup_write = os.pipe()
+            os.set_blocking(self._wakeup_read, False)
+            os.set_blocking(self._wakeup_write, False)
+            return
+
+        if os.name != "posix":
+            self._semaphore = threading.Semaphore(jobs)
+            return
+
+        read_fd, self._write_fd = os.pipe()
+        os.set_inheritable(read_fd, True)
+        os.set_inheritable(self._write_fd, True)
+        self._read_fd = _open_nonblocking(read_fd)
+        # All slots go in the pipe. Children still get their implicit slot from
+        # the token held for them.
+        os.write(self._write_fd, b"+" * jobs)
+        makeflags = os.environ.get("MAKEFLAGS", "")
+        self._makeflags = f"{makeflags} --jobserver-auth={read_fd},{self._write_fd}".strip()
+
+
+    def grow(self, jobs: int) -> None:
+        """Serves at least jobs job slots.
+
+        Has no effect when joined to the jobserver of make, whose -j limits the slots.
+        """
+        with self._lock:
+            if jobs <= self.jobs or self._wakeup_read is not None:
+                return
+            if self._semaphore is not None:
+                for _ in range(jobs - self.jobs):
+                    self._semaphore.release()
+            else:
+                os.write(self._write_fd, b"+" * (jobs - self.jobs))
+            self.jobs = jobs
+
+
+    @property
+    def env(self) -> dict[str, str]:
+        """The environment for subprocesses.
+
+        A copy of the current os.environ, which advertises the jobserver in
+        MAKEFLAGS when serving.
+        """
+        env = os.environ.copy()
+        if self._makeflags is not None:
+            env["MAKEFLAGS"] = f"{self._makeflags} -j{self.jobs}"
+        return env
+
+
+    def acquire(self) -> bytes:
+        """Blocks until a job slot is free and returns its token."""
+        if self._semaphore is not None:
+            self._semaphore.acquire()
+            return None
+
+        wait_fds = [self._read_fd]
+        if self._wakeup_read is not None:
+            wait_fds.append(self._wakeup_read)
+        while True:
+            with self._lock:
+                if self._implicit_free:
+                    self._implicit_free = False
+                    return None
+            try:
+                token = os.read(self._read_fd, 1)
+            except (BlockingIOError, InterruptedError):
+                token = None
+            if token:
+                return token
+            # Another process may take the token first, so wait and try again
+            readable, _, _ = select.select(wait_fds, [], [])
+            if self._wakeup_read in readable:
+                try:
+                    os.read(self._wakeup_read, 64)
+                except BlockingIOError:
+                    pass
+
+
+    def release(self, token: bytes) -> None:
+        """Frees the job slot of token, as returned by acquire."""
+        if self._semaphore is not None:
+            self._semaphore.release()
+        elif token is None:
+            with self._lock:
+                self._implicit_free = True
+            try:
+                os.write(self._wakeup_write, b"+")
+            except BlockingIOError:
+                # The pipe is full of wakeups already
+                pass
+        else:
+            os.write(self._write_fd, token)
+
+
+def _open_nonblocking(fd: int) -> int:
+    """Returns a non-blocking file descriptor reading the same pipe as fd.
+
+    On Linux, the pipe is reopened so that the flag does not change the open file
+    description shared with other processes. Elsewhere, fd is returned as it is,
+    and select guards the reads.
+    """
+    try:
+        return os.open(f"/proc/self/fd/{fd}", os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        os.fstat(fd)
+        return fd
+
+
+def _jobserver_auth(makeflags: str) -> str:
+    """Returns the jobserver of MAKEFLAGS, as "R,W" or "fifo:PATH", or None."""
+    auth = None
+    for flag in makeflags.split():
+        for option in ("--jobserver-auth=", "--jobserver-fds="):
+            if flag.startswith(option):
+                auth = flag[len(option):]
+    return auth
+
+
+_jobserver = None
+_jobserver_lock = threading.Lock()
+
+
+def _get_jobserver() -> Jobserver:
+    """Returns the Jobserver of this process, connecting to it on first use."""
+    global _jobserver
+    with _jobserver_lock:
+        if _jobserver is None:
+            _jobserver = Jobserver()
+        return _jobserver
+
+
+_POOL_WORKER = """
+import json
+import os
+import subprocess
+import sys
+
+# Output of the commands goes to stderr, stdout replies to the pool, and stdin carries
+# the commands, so the commands get no input. posix_spawn is only used if the
+# redirection is not to one of the standard file descriptors.
+stderr = os.dup(2)
+for line in sys.stdin:
+    cmd = json.loads(line)
+    try:
+        returncode = subprocess.run(
+            cmd, stdin=subprocess.DEVNULL, stdout=stderr, close_fds=False).returncode
+    except OSError as e:
+        # Like the shell, 127 if the program is missing and 126 if it cannot run
+        print(e, file=sys.stderr, flush=True)
+        returncode = 127 if isinstance(e, FileNotFoundError) else 126
+    print(returncode, flush=True)
+"""
+
+
+class CompilerPool:
+    """Runs commands through persistent worker processes.
+
+    Each worker reads commands as JSON lines and replies with their return codes.
+    Spawning the commands from the small workers avoids forking the build script,
+    which may have grown large, for every command.
+    """
+    def __init__(self, workers: int=None):
+        """Initializes a CompilerPool and starts its workers.
+
+        workers
+          The number of worker processes. Defaults to os.cpu_count().
+        """
+        if workers is None:
+            workers = os.cpu_count() or 1
+        if type(workers) is not int or workers < 1:
+            raise ValueError(f"workers {workers} should be a positive integer")
+
+        self._workers = set()
+        self._workers_lock = threading.Lock()
+        self._idle = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(self._start_worker())
+
+
+    def _start_worker(self) -> subprocess.Popen:
+        """Starts a worker process."""
+        worker = subprocess.Popen(
+            [sys.executable, "-c", _POOL_WORKER],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+            env=_get_jobserver().env, close_fds=False)
+        with self._workers_lock:
+            self._workers.add(worker)
+        return worker
+
+
+    def run(self, cmd: list[str]) -> int:
+        """Runs cmd on an idle worker, waiting for one if necessary, and returns its return code."""
+        worker = self._idle.get()
+        reply = ""
+        try:
+            worker.stdin.write(json.dumps(cmd) + "\n")
+            worker.stdin.flush()
+            reply = worker.stdout.readline()
+        except BrokenPipeError:
+            pass
+        finally:
+            # A worker which exited is replaced rather than handed out again
+            if reply:
+                self._idle.put(worker)
+            else:
+                self._discard(worker)
+                self._idle.put(self._start_worker())
+        if not reply:
+            raise ChildProcessError(f"The compiler pool worker running {cmd} exited")
+        return int(reply)
+
+
+    def _discard(self, worker: subprocess.Popen) -> None:
+        """Reaps a worker which exited."""
+        with self._workers_lock:
+            self._workers.discard(worker)
+        for pipe in (worker.stdin, worker.stdout):
+            try:
+                pipe.close()
+            except BrokenPipeError:
+                pass
+        worker.wait()
+
+
+    def close(self) -> None:
+        """Stops the workers."""
+        with self._workers_lock:
+            workers = list(self._workers)
+        for worker in workers:
+            try:
+                worker.stdin.close()
+            except BrokenPipeError:
+                pass
+            worker.wait()
+
+
+_compiler_pool = None
+_compiler_pool_lock = threading.Lock()
+
+
+def _get_compiler_pool() -> CompilerPool:
+    """Returns the CompilerPool of this process, starting it on first use.
+
+    Returns None unless the environment variable VROG_COMPILER_POOL is 1.
+    """
+    global _compiler_pool
+    if os.environ.get("VROG_COMPILER_POOL") != "1":
+        return None
+    with _compiler_pool_lock:
+        if _compiler_pool is None:
+            _compiler_pool = CompilerPool()
+            atexit.register(_compiler_pool.close)
+        return _compiler_pool
+
+
+@functools.lru_cache(maxsize=None)
+def _which(program: str, path: str) -> str:
+    """Returns the path of program as found in path, or program if it is not found.
+
+    path is part of the cache key, so a change of PATH is seen.
+    """
+    return shutil.which(program, path=path) or program
+
+
+def _spawnable(cmd: list[str]) -> list[str]:
+    """Returns cmd with its program resolved to a path.
+
+    subprocess starts a program with posix_spawn, which unlike fork does not copy
+    the page tables of the build script, only if the program is given as a path
+    and file descriptors are not closed. Setting the environment variable
+    VROG_SPAWN to fork leaves cmd as it is, so subprocess forks and execs.
+    """
+    if os.environ.get("VROG_SPAWN", "posix_spawn") == "fork":
+        return cmd
+    return [_which(cmd[0], os.environ.get("PATH"))] + cmd[1:]
+
+
+def _run(cmd: list[str], check: bool=False, pooled: bool=False) -> subprocess.CompletedProcess:
+    """Runs cmd while holding a job slot.
+
+    The jobserver file descriptors are inherited so cmd may use the jobserver too.
+
+    cmd
+      The program and its arguments.
+    check
+      If True, raises CalledProcessError if cmd fails.
+    pooled
+      If True, runs cmd through the CompilerPool when it is enabled.
+    """
+    cmd = _spawnable(cmd)
+    jobserver = _get_jobserver()
+    token = jobserver.acquire()
+    try:
+        pool = _get_compiler_pool() if pooled else None
+        if pool is None:
+            return subprocess.run(cmd, check=check, env=jobserver.env, close_fds=False)
+        completed = subprocess.CompletedProcess(cmd, pool.run(cmd))
+        if check:
+            completed.check_returncode()
+        return completed
+    finally:
+        jobserver.release(token)
+
+
+async def _run_async(cmd: list[str]) -> None:
+    """Runs cmd as an asyncio subprocess while holding a job slot.
+
+    The output of cmd is written once it exits, so the output of concurrent
+    commands does not interleave. Raises CalledProcessError if cmd fails.
+    """
+    cmd = _spawnable(cmd)
+    jobserver = _get_jobserver()
+    # Reading a token blocks, so wait for it in a thread
+    acquire = asyncio.get_running_loop().run_in_executor(None, jobserver.acquire)
+    try:
+        token = await asyncio.shield(acquire)
+    except asyncio.CancelledError:
+        # Give back the token the thread still gets
+        acquire.add_done_callback(
+            lambda acquired: acquired.exception() or jobserver.release(acquired.result()))
+        raise
+    try:
+        process = await asyncio.create_subprocess_exec(
+            *cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            env=jobserver.env, close_fds=False)
+        try:
+            stdout, stderr = await process.communicate()
+        except asyncio.CancelledError:
+            # The slot is only free once the process is gone
+            process.kill()
+            await process.wait()
+            raise
+    finally:
+        jobserver.release(token)
+
+    sys.stdout.buffer.write(stdout)
+    sys.stdout.flush()
+    sys.stderr.buffer.write(stderr)
+    sys.stderr.flush()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, cmd, stdout, stderr)
+
+
+def _tarjan_scc(indptr: array.array, indices: array.array) -> list[int]:
+    """Finds the strongly connected components of a graph with Tarjan's algorithm.
+
+    The edges of node are indices[indptr[node]:indptr[node + 1]]. Returns the
+    component of each node. Components are numbered in the order they are
+    completed, so edges only lead to the same or lower numbered components.
+    """
+    count = len(indptr) - 1
+    index = [-1] * count
+    lowlink = [0] * count
+    on_stack = bytearray(count)
+    component = [-1] * count
+    component_stack = []
+    visited = 0
+    components = 0
+
+    for root in range(count):
+        if index[root] != -1:
+            continue
+        index[root] = lowlink[root] = visited
+        visited += 1
+        component_stack.append(root)
+        on_stack[root] = 1
+        # Explicit stack of (node, position of its next edge)
+        work = [(root, indptr[root])]
+        while work:
+            node, position = work[-1]
+            end = indptr[node + 1]
+            while position < end:
+                dep = indices[position]
+                position += 1
+                if index[dep] == -1:
+                    break
+                if on_stack[dep] and index[dep] < lowlink[node]:
+                    lowlink[node] = index[dep]
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    if lowlink[node] < lowlink[parent]:
+                        lowlink[parent] = lowlink[node]
+                if lowlink[node] == index[node]:
+                    while True:
+                        member = component_stack.pop()
+                        on_stack[member] = 0
+                        component[member] = components
+                        if member == node:
+                            break
+                    components += 1
+                continue
+
+            work[-1] = (node, position)
+            index[dep] = lowlink[dep] = visited
+            visited += 1
+            component_stack.append(dep)
+            on_stack[dep] = 1
+            work.append((dep, indptr[dep]))
+
+    return component
+
+
+def _circular_nodes(indptr: array.array, indices: array.array) -> tuple[bytearray, list[int]]:
+    """Finds the nodes of a graph which are on or lead to a cycle.
+
+    The edges of node are indices[indptr[node]:indptr[node + 1]]. Returns whether
+    each node is circular, and the nodes of the lowest numbered strongly connected
+    component which is a cycle, or an empty list if there is none.
+    """
+    component = _tarjan_scc(indptr, indices)
+    sizes = [0] * (max(component, default=-1) + 1)
+    for node in range(len(component)):
+        sizes[component[node]] += 1
+    # Whether each component is or leads to a cycle
+    circular = bytearray(len(sizes))
+    cycle = -1
+    # Dependencies are in lower numbered components, so visit components in order
+    for node in sorted(range(len(component)), key=component.__getitem__):
+        deps = indices[indptr[node]:indptr[node + 1]]
+        if sizes[component[node]] > 1 or node in deps:
+            circular[component[node]] = 1
+            if cycle == -1:
+                cycle = component[node]
+        elif any(circular[component[dep]] for dep in deps):
+            circular[component[node]] = 1
+
+    members = [] if cycle == -1 else [
+        node for node in range(len(component)) if component[node] == cycle]
+    return bytearray(circular[component[node]] for node in range(len(component))), members
+
+
+def _kahn_waves(
+    indptr: array.array,
+    indices: array.array,
+    root: int,
+    rule_count: int
+) -> tuple[list[int], list[int]]:
+    """Schedules the nodes reachable from root in waves with Kahn's algorithm.
+
+    The edges of node are indices[indptr[node]:indptr[node + 1]], and must be free
+    of cycles. Nodes from rule_count on are left out. Returns the nodes ordered by
+    wave, and the end of each wave in that order.
+    """
+    pending = [-1] * rule_count
+    dependents = collections.defaultdict(list)
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if pending[node] != -1:
+            continue
+        pending[node] = 0
+        for dep in indices[indptr[node]:indptr[node + 1]]:
+            if dep < rule_count:
+                pending[node] += 1
+                dependents[dep].append(node)
+                stack.append(dep)
+
+    order = [node for node in range(rule_count) if pending[node] == 0]
+    ends = []
+    start = 0
+    while start < len(order):
+        end = len(order)
+        for node in order[start:end]:
+            for dependent in dependents[node]:
+                pending[dependent] -= 1
+                if pending[dependent] == 0:
+                    order.append(dependent)
+        ends.append(end)
+        start = end
+    return order, ends
+
+
+# Importing Numba and loading the cached kernels takes about 0.35 s, which the
+# kernels only make up for from about 250,000 targets and dependencies. The first
+# run compiles the kernels, which takes a few seconds more.
+_NUMBA_MIN_NODES = 250000
+
+
+@functools.cache
+def _load_graph_numba():
+    """Returns the _graph_numba module, or None if numba or numpy is not installed."""
+    # _graph_numba sits next to vrog.py, which is imported either as a module of
+    # the vrog package or as the top-level module vrog
+    name = f"{__package__}._graph_numba" if __package__ else "_graph_numba"
+    try:
+        return importlib.import_module(name)
+    except ModuleNotFoundError as e:
+        if e.name in ("numba", "numpy"):
+            return None
+        raise
+
+
+def _circular(indptr: array.array, indices: array.array) -> tuple[bytearray, list[int]]:
+    """Returns _circular_nodes(indptr, indices), compiled with Numba for large graphs if
+    available."""
+    graph_numba = _load_graph_numba() if len(indptr) > _NUMBA_MIN_NODES else None
+    if graph_numba is None:
+        return _circular_nodes(indptr, indices)
+    circular, cycle = graph_numba.circular_nodes(*graph_numba.csr(indptr, indices))
+    return bytearray(circular), cycle.tolist()
+
+
+def _waves(
+    indptr: array.array,
+    indices: array.array,
+    root: int,
+    rule_count: int
+) -> tuple[list[int], list[int]]:
+    """Returns _kahn_waves(indptr, indices, root, rule_count), compiled with Numba for
+    large graphs if available."""
+    graph_numba = _load_graph_numba() if len(indptr) > _NUMBA_MIN_NODES else None
+    if graph_numba is None:
+        return _kahn_waves(indptr, indices, root, rule_count)
+    order, ends = graph_numba.kahn_waves(*graph_numba.csr(indptr, indices), root, rule_count)
+    return order.tolist(), ends.tolist()
 
 
 class BuildSystem:
     """A system of rules for how to build targets."""
-    def __init__(self):
-        """Initializes a BuildSystem."""
+    def __init__(self, cache: str=".vrog-cache"):
+        """Initializes a BuildSystem.
+
+        cache
+          The file recording what the targets were built from, or None to decide
+          whether a target is up to date by modification times only.
+        """
+        if __debug__:
+            if cache is not None and type(cache) is not str:
+                raise TypeError(f"cache {cache} should be a string or None")
         self.rules = {}
+        self.jobserver = _get_jobserver()
+        self.compiler_pool = _get_compiler_pool()
+        self._name2id = None
+        self._id2name = None
+        self._deps_indptr = None
+        self._deps_indices = None
+        self._circular = None
+        self._stat_cache = {}
+        self._scanned_dirs = set()
+        self._dir_entries = {}
+        self._hash_cache = {}
+        self._built = bytearray()
+        self._cache = None
+        self._cache_lock = threading.Lock()
+        if cache is not None:
+            self._cache = sqlite3.connect(cache, check_same_thread=False)
+            self._cache.execute(
+                "CREATE TABLE IF NOT EXISTS targets"
+                " (target TEXT PRIMARY KEY, sig BLOB, output BLOB)")
 
 
     def add_rule(self, target: str, rule: BuildRule) -> None:
@@ -208,11 +900,14 @@ class BuildSystem:
         rule
           The BuildRule providing the target's dependencies and the task which builds it.
         """
-        if type(target) is not str:
-            raise TypeError(f"target {target} should be a string")
-        if not isinstance(rule, BuildRule):
-            raise TypeError(f"rule {rule} should be a BuildRule or inherited from it")
+        if __debug__:
+            if type(target) is not str:
+                raise TypeError(f"target {target} should be a string")
+            if not isinstance(rule, BuildRule):
+                raise TypeError(f"rule {rule} should be a BuildRule or inherited from it")
         self.rules[target] = rule
+        self._id2name = None
+        self._circular = None
 
 
     def add_ctarget(
@@ -235,8 +930,11 @@ class BuildSystem:
         """
         objects = [f"{source}.o" for source in sources]
         self.add_rule(target, LinkerRule(objects, linker))
-        for obj, source in zip(objects, sources):
-            self.add_rule(obj, CompilerRule(source, compiler))
+        # Generating the dependencies of each source spawns the compiler, do it concurrently
+        with concurrent.futures.ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            rules = executor.map(functools.partial(CompilerRule, compiler=compiler), sources)
+            for obj, rule in zip(objects, rules):
+                self.add_rule(obj, rule)
 
 
     def add_clean(self, target: str="clean") -> None:
@@ -250,38 +948,421 @@ class BuildSystem:
 
     def build(self, target: str) -> None:
         """Builds target, building dependencies as necessary to keep target up to date"""
-        if type(target) is not str:
-            raise TypeError(f"target {target} should be a string")
+        if __debug__:
+            if type(target) is not str:
+                raise TypeError(f"target {target} should be a string")
 
         if target not in self.rules:
             raise ValueError(f"No rule for target {target}")
 
-        if self.circular(target):
+        self._compile_graph()
+        self._find_cycle()
+        if self._circular[self._name2id[target]]:
             raise RecursionError(f"The dependency chain for {target} is circular")
 
-        for dep in self.rules[target].deps:
-            if dep in self.rules:
-                self.build(dep)
+        self._built = bytearray(len(self._id2name))
+        try:
+            self._prime_stat_cache(self._paths())
+            self._build(self._name2id[target])
+        finally:
+            self._end_build()
 
-        if not os.path.exists(target):
-            print(target)
-            self.rules[target].task(target)
+
+    def _build(self, root: int) -> None:
+        """Builds the target root after its dependencies. The rules must be free of cycles."""
+        indptr = self._deps_indptr
+        indices = self._deps_indices
+        rule_count = len(self.rules)
+        # Explicit stack of (node, position of its next dependency)
+        stack = [(root, indptr[root])]
+        while stack:
+            node, position = stack[-1]
+            end = indptr[node + 1]
+            while position < end:
+                dep = indices[position]
+                position += 1
+                if dep < rule_count and not self._built[dep]:
+                    break
+            else:
+                stack.pop()
+                self._maybe_run(self._id2name[node])
+                self._built[node] = 1
+                continue
+            stack[-1] = (node, position)
+            stack.append((dep, indptr[dep]))
+
+
+    def build_parallel(self, target: str, jobs: int=None) -> None:
+        """Builds target like build, running independent tasks concurrently.
+
+        The commands of rules are supervised by a single asyncio event loop, and
+        tasks of rules without a command run in threads.
+
+        target
+          The target to build.
+        jobs
+          The maximum number of concurrent tasks. Defaults to os.cpu_count().
+          If 1, falls back to build. The jobserver serves at least jobs slots,
+          unless it is joined to the jobserver of make, whose -j limits the
+          subprocesses instead.
+        """
+        if __debug__:
+            if type(target) is not str:
+                raise TypeError(f"target {target} should be a string")
+
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        if type(jobs) is not int or jobs < 1:
+            raise ValueError(f"jobs {jobs} should be a positive integer")
+
+        if jobs == 1:
+            self.build(target)
+            return
+
+        if target not in self.rules:
+            raise ValueError(f"No rule for target {target}")
+
+        self._compile_graph()
+        self._find_cycle()
+        if self._circular[self._name2id[target]]:
+            raise RecursionError(f"The dependency chain for {target} is circular")
+
+        # Waves of mutually independent targets, each depending only on earlier waves
+        order, ends = _waves(
+            self._deps_indptr, self._deps_indices, self._name2id[target], len(self.rules))
+
+        self.jobserver.grow(jobs)
+        self._built = bytearray(len(self._id2name))
+        try:
+            self._prime_stat_cache(self._paths())
+            asyncio.run(self._drive(order, ends, jobs))
+        finally:
+            self._end_build()
+
+
+    async def _drive(self, order: list[int], ends: list[int], jobs: int) -> None:
+        """Builds the waves of target ids returned by _waves, running up to jobs tasks at once."""
+        semaphore = asyncio.Semaphore(jobs)
+        # Tasks without a command and jobserver waits hold a thread, at most jobs at once
+        asyncio.get_running_loop().set_default_executor(
+            concurrent.futures.ThreadPoolExecutor(jobs))
+        start = 0
+        for end in ends:
+            wave = order[start:end]
+            start = end
+            # Running tasks finish before the first error is raised
+            results = await asyncio.gather(
+                *(self._maybe_run_async(self._id2name[node], semaphore) for node in wave),
+                return_exceptions=True)
+            for result in results:
+                if isinstance(result, BaseException):
+                    raise result
+            for node in wave:
+                self._built[node] = 1
+
+
+    def watch(self, target: str) -> None:
+        """Builds target, then rebuilds it whenever a source it depends on is written.
+
+        The directories of the sources are watched rather than each source, with a
+        single inotify instance. Failed builds are reported and watching continues.
+        Runs until interrupted. Requires Linux and the inotify_simple package.
+
+        target
+          The target to build.
+        """
+        if __debug__:
+            if type(target) is not str:
+                raise TypeError(f"target {target} should be a string")
+        if inotify_simple is None:
+            raise ModuleNotFoundError("BuildSystem.watch requires the inotify_simple package")
+
+        self.build(target)
+
+        # The dependencies without rules reachable from target
+        rule_count = len(self.rules)
+        reachable = bytearray(len(self._id2name))
+        stack = [self._name2id[target]]
+        while stack:
+            node = stack.pop()
+            if reachable[node]:
+                continue
+            reachable[node] = 1
+            stack.extend(self._deps_indices[self._deps_indptr[node]:self._deps_indptr[node + 1]])
+        sources = {
+            self._id2name[id] for id in range(rule_count, len(self._id2name)) if reachable[id]}
+
+        mask = (inotify_simple.flags.CLOSE_WRITE | inotify_simple.flags.MOVED_TO
+                | inotify_simple.flags.CREATE)
+        with inotify_simple.INotify() as inotify:
+            directories = {}
+            for directory in {os.path.dirname(source) for source in sources}:
+                directories[inotify.add_watch(directory or ".", mask)] = directory
+            while True:
+                # Wait a little after the first event so an editor's writes arrive together
+                events = inotify.read(read_delay=50)
+                for event in events:
+                    # Events were dropped if the queue overflowed, so a source may have changed
+                    if event.mask & inotify_simple.flags.Q_OVERFLOW:
+                        break
+                    # Events of removed watches and the overflow event have no directory
+                    directory = directories.get(event.wd)
+                    if directory is not None and os.path.join(directory, event.name) in sources:
+                        break
+                else:
+                    continue
+                try:
+                    self.build(target)
+                except subprocess.CalledProcessError as error:
+                    print(error, file=sys.stderr)
+
+
+    def _compile_graph(self) -> None:
+        """Interns the targets and dependencies of the rules to integer ids.
+
+        Targets with rules get the ids below len(self.rules), in the order of
+        self.rules, and the other dependencies the ids after them. The dependencies
+        of id are self._deps_indices[self._deps_indptr[id]:self._deps_indptr[id + 1]].
+        """
+        id2name = list(self.rules)
+        name2id = {name: id for id, name in enumerate(id2name)}
+        indptr = array.array("i", [0])
+        indices = array.array("i")
+        for rule in self.rules.values():
+            for dep in dict.fromkeys(rule.deps):
+                id = name2id.get(dep)
+                if id is None:
+                    id = name2id[dep] = len(id2name)
+                    id2name.append(dep)
+                indices.append(id)
+            indptr.append(len(indices))
+        # Dependencies without rules have no dependencies themselves
+        indptr.extend([len(indices)] * (len(id2name) - len(self.rules)))
+
+        self._name2id = name2id
+        self._id2name = id2name
+        self._deps_indptr = indptr
+        self._deps_indices = indices
+
+
+    def _maybe_run(self, target: str) -> None:
+        """Runs the task of target if target is out of date."""
+        out_of_date, signature = self._out_of_date(target)
+        if not out_of_date:
             return
 
-        for dep in self.rules[target].deps:
-            if os.path.getmtime(target) < os.path.getmtime(dep):
-                print(target)
-                self.rules[target].task(target)
+        print(target)
+        self.rules[target].task(target)
+        self._record(target, signature)
+
+
+    async def _maybe_run_async(self, target: str, semaphore: asyncio.Semaphore) -> None:
+        """Runs the task of target if target is out of date, while holding semaphore.
+
+        If the rule of target has a command, it is run as an asyncio subprocess.
+        Otherwise, the task is called in a thread. Files are hashed in threads too,
+        so that they do not hold up the event loop.
+        """
+        async with semaphore:
+            out_of_date, signature = await asyncio.to_thread(self._out_of_date, target)
+            if not out_of_date:
                 return
 
+            print(target)
+            rule = self.rules[target]
+            cmd = rule.command(target)
+            if cmd is None or self.compiler_pool is not None:
+                await asyncio.to_thread(rule.task, target)
+            else:
+                await _run_async(cmd)
+            await asyncio.to_thread(self._record, target, signature)
+
 
-    def circular(self, target: str, _dependents: set[str]=set()) -> bool:
-        """Checks if there is a dependency circularity for target"""
-        if type(target) is not str:
-            raise TypeError(f"target {target} should be a string")
+    def _out_of_date(self, target: str) -> tuple[bool, bytes]:
+        """Checks whether target is out of date.
+
+        With a cache, target is out of date if it is missing, or if it, its
+        dependencies or its command differ from when it was last built.
+        Without, target is out of date if it is missing or older than a dependency.
+        Returns whether target is out of date, and its signature for _record.
+        """
+        stat = self._stat(target)
+        if self._cache is None:
+            if stat is None:
+                return True, None
+            for dep in self.rules[target].deps:
+                dep_stat = self._stat(dep)
+                if dep_stat is None:
+                    raise FileNotFoundError(f"Dependency {dep} of {target} does not exist")
+                if stat.st_mtime < dep_stat.st_mtime:
+                    return True, None
+            return False, None
+
+        signature = self._signature(target)
+        if stat is None:
+            return True, signature
+        with self._cache_lock:
+            row = self._cache.execute(
+                "SELECT sig, output FROM targets WHERE target = ?", (target,)).fetchone()
+        return row != (signature, self._hash(target)), signature
+
+
+    def _record(self, target: str, signature: bytes) -> None:
+        """Records that target was built with signature, as returned by _out_of_date."""
+        # Dependents must see the new target
+        self._stat_cache.pop(target, None)
+        self._dir_entries.pop(target, None)
+        self._hash_cache.pop(target, None)
+
+        if self._cache is not None:
+            with self._cache_lock:
+                self._cache.execute(
+                    "INSERT OR REPLACE INTO targets VALUES (?, ?, ?)",
+                    (target, signature, self._hash(target)))
+
+
+    def _signature(self, target: str) -> bytes:
+        """Returns the hash of the dependencies of target and the command building it."""
+        rule = self.rules[target]
+        signature = hashlib.blake2b(digest_size=_DIGEST_SIZE)
+        for dep in sorted(rule.deps):
+            digest = self._hash(dep)
+            signature.update(dep.encode() + b"\0" + (digest if digest is not None else b"-"))
+        signature.update(repr(rule.command(target)).encode())
+        return signature.digest()
+
+
+    def _hash(self, path: str) -> bytes:
+        """Returns the hash of the contents of path, or None if it does not exist.
+
+        Cached per build.
+        """
+        try:
+            return self._hash_cache[path]
+        except KeyError:
+            pass
+        digest = None if self._stat(path) is None else hash_file(path)
+        self._hash_cache[path] = digest
+        return digest
+
+
+    def _end_build(self) -> None:
+        """Clears the per build state and saves the build cache."""
+        self._stat_cache = {}
+        self._scanned_dirs = set()
+        self._dir_entries = {}
+        self._hash_cache = {}
+        self._built = bytearray()
+        if self._cache is not None:
+            with self._cache_lock:
+                self._cache.commit()
+
+
+    def _stat(self, path: str) -> os.stat_result:
+        """Returns the os.stat of path, or None if it does not exist, cached per build.
+
+        On Windows, the first lookup in a directory caches the os.DirEntry of all
+        its entries, whose stats come with the listing, since targets tend to be
+        looked up along with their siblings. Elsewhere, DirEntry.stat costs a
+        system call like os.stat, so paths are stat'ed directly.
+        """
+        try:
+            return self._stat_cache[path]
+        except KeyError:
+            pass
+
+        directory = os.path.dirname(path)
+        if os.name == "nt" and directory not in self._scanned_dirs:
+            self._scanned_dirs.add(directory)
+            try:
+                with os.scandir(directory or ".") as entries:
+                    for entry in entries:
+                        self._dir_entries.setdefault(os.path.join(directory, entry.name), entry)
+            except OSError:
+                pass
+
+        entry = self._dir_entries.pop(path, None)
+        if entry is not None:
+            try:
+                stat = entry.stat()
+            except OSError:
+                pass
+            else:
+                self._stat_cache[path] = stat
+                return stat
+
+        # Not in the listing, created since, or the entry could not be stat'ed
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+        self._stat_cache[path] = stat
+        return stat
+
+
+    def _paths(self) -> list[str]:
+        """Returns the targets and dependencies of all rules."""
+        return self._id2name
+
+
+    def _prime_stat_cache(self, paths: list[str]) -> None:
+        """Stats paths into the stat cache at once.
+
+        On Linux, the stats are submitted in batches through io_uring if the liburing
+        package is installed, unless the environment variable VROG_DISABLE_IO_URING
+        is set. Otherwise, paths are stated one by one.
+        """
+        paths = [path for path in paths if path not in self._stat_cache]
+        if (liburing is None or sys.platform != "linux"
+                or os.environ.get("VROG_DISABLE_IO_URING")):
+            for path in paths:
+                self._stat(path)
+            return
+
+        depth = min(len(paths), 16384)
+        if depth == 0:
+            return
+        ring = liburing.Ring()
+        cqe = liburing.Cqe()
+        liburing.io_uring_queue_init(depth, ring)
+        try:
+            for start in range(0, len(paths), depth):
+                batch = paths[start:start + depth]
+                statxs = [liburing.Statx() for _ in batch]
+                for path, statx in zip(batch, statxs):
+                    sqe = liburing.io_uring_get_sqe(ring)
+                    liburing.io_uring_prep_statx(
+                        sqe, statx, path, mask=liburing.STATX_BASIC_STATS)
+                liburing.io_uring_submit_and_wait(ring, len(batch))
+                completed = 0
+                while completed < len(batch):
+                    liburing.io_uring_wait_cqe(ring, cqe)
+                    ready = liburing.io_uring_cq_ready(ring)
+                    liburing.io_uring_cq_advance(ring, ready)
+                    completed += ready
+
+                for path, statx in zip(batch, statxs):
+                    # A failed statx leaves its buffer unset, stat it again for the error
+                    if not statx.mask & liburing.STATX_MTIME:
+                        self._stat(path)
+                        continue
+                    self._stat_cache[path] = os.stat_result(
+                        (statx.mode, statx.ino, os.makedev(statx.dev_major, statx.dev_minor),
+                         statx.nlink, statx.uid, statx.gid, statx.size,
+                         int(statx.atime), int(statx.mtime), int(statx.ctime)),
+                        {"st_atime": statx.atime, "st_mtime": statx.mtime,
+                         "st_ctime": statx.ctime})
+        finally:
+            liburing.io_uring_queue_exit(ring)
 
-        if type(_dependents) is not set:
-            raise TypeError(f"_dependendts {_dependents} should be a set")
+
+    def circular(self, target: str, _dependents: frozenset[str]=frozenset()) -> bool:
+        """Checks if there is a dependency circularity for target"""
+        if __debug__:
+            if type(target) is not str:
+                raise TypeError(f"target {target} should be a string")
+            if not isinstance(_dependents, (set, frozenset)):
+                raise TypeError(f"_dependents {_dependents} should be a set or frozenset")
 
         if target in _dependents:
             return True
@@ -289,17 +1370,77 @@ class BuildSystem:
         if target not in self.rules:
             return False
 
-        for dep in self.rules[target].deps:
-            if self.circular(dep, _dependents.union({target})):
-                return True
+        if self._circular is None:
+            if self._id2name is None:
+                self._compile_graph()
+            self._find_cycle()
+        return bool(self._circular[self._name2id[target]])
+
+
+    def _find_cycle(self) -> list[str]:
+        """Finds the strongly connected components of the rules with Tarjan's algorithm.
+
+        Records in self._circular whether the dependency chain of each target id is
+        circular, and returns the targets of one cycle, or None if there is none.
+        """
+        self._circular, cycle = _circular(self._deps_indptr, self._deps_indices)
+        return [self._id2name[id] for id in cycle] or None
+
 
-        return False
+# Digests are truncated to this size, which is plenty to tell file versions apart
+_DIGEST_SIZE = 16
+# Smaller files are cheaper to read than to map
+_MMAP_MIN_SIZE = 64 * 1024
 
 
-def run_cmd(cmd: str) -> subprocess.CompletedProcess:
-    """Runs cmd through the shell"""
-    if type(cmd) is not str:
-        raise TypeError(f"cmd {cmd} should be a string")
-    return subprocess.run(["sh", "-c", cmd], check=True)
+def hash_file(path: str) -> bytes:
+    """Returns a 16 byte digest of the contents of the file path.
 
+    The digest is BLAKE3 if the blake3 package is installed, and SHA-256 otherwise.
+    """
+    with open(path, "rb") as file:
+        if os.fstat(file.fileno()).st_size >= _MMAP_MIN_SIZE:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as contents:
+                if blake3 is not None:
+                    hasher = blake3.blake3(contents, max_threads=blake3.blake3.AUTO)
+                    return hasher.digest(_DIGEST_SIZE)
+                return hashlib.sha256(contents).digest()[:_DIGEST_SIZE]
+        if blake3 is not None:
+            return blake3.blake3(file.read()).digest(_DIGEST_SIZE)
+        return hashlib.file_digest(file, "sha256").digest()[:_DIGEST_SIZE]
+
+
+# Characters which make sh do more than split a command into words
+_SHELL_METACHARACTERS = re.compile(r"[|&;<>()$`\\\"'*?~#!\[\]{}\n]")
+
+# Words which sh runs itself rather than as a program
+_SHELL_WORDS = frozenset((
+    ".", ":", "alias", "break", "case", "cd", "command", "continue", "do", "done",
+    "elif", "else", "esac", "eval", "exec", "exit", "export", "fi", "for", "function",
+    "getopts", "hash", "if", "read", "readonly", "return", "set", "shift", "source",
+    "then", "time", "times", "trap", "type", "ulimit", "umask", "unalias", "unset",
+    "until", "wait", "while"))
 
+
+def run_cmd(cmd: list[str] | str) -> subprocess.CompletedProcess:
+    """Runs cmd.
+
+    cmd
+      The program and its arguments, or a string to split into them. A string
+      with shell metacharacters, such as pipes or redirections, starting with a
+      variable assignment or a shell builtin, or without any word, is run through
+      sh. Pass a list to never use a shell.
+    """
+    if type(cmd) is str:
+        words = cmd.split()
+        if (not words or "=" in words[0] or words[0] in _SHELL_WORDS
+                or _SHELL_METACHARACTERS.search(cmd)):
+            cmd = ["sh", "-c", cmd]
+        else:
+            cmd = words
+    if __debug__:
+        if not isinstance(cmd, list):
+            raise TypeError(f"cmd {cmd} should be a list or a string")
+    if not cmd:
+        raise ValueError("cmd should not be empty")
+    return _run(cmd, check=True)